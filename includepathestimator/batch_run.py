@@ -6,13 +6,59 @@
 """ Batch analysis of all extracted cmsis packs in components folder."""
 
 import os
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from modules import estimateincludepaths as eip
 from modules import pdsccoverage as pcov
 
 location = r'..\components'
-subfolders = [f.path for f in os.scandir(location) if f.is_dir()]
-print(subfolders)
-for f in subfolders:
-    print("Analyzing folder:", f)
-    eip.estimate_include_paths(f)
-    pcov.pdsc_coverage(f)
+
+
+def args():
+    """Load arguments from command line."""
+    parser = argparse.ArgumentParser(
+        description="Batch analysis of extracted cmsis packs.",
+        epilog=r"Example: python batch_run.py -j 4",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=os.cpu_count(),
+        help=" Number of packs analyzed in parallel.",
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help=" Skip include path estimation of packs not changed since last run.",
+    )
+    return parser.parse_args()
+
+
+def pack_folders(folder):
+    """Yield pack folders while the components folder is being scanned."""
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                yield entry.path
+
+
+def analyze(folder, skip_unchanged=False):
+    """Run include path estimation and pdsc coverage for single pack.
+    Main functions are detected in the same worker, packs run in parallel already."""
+    print("Analyzing folder:", folder)
+    eip.estimate_include_paths(folder, skip_unchanged=skip_unchanged, jobs=1)
+    pcov.pdsc_coverage(folder)
+
+
+# --------MAIN--------
+if __name__ == "__main__":
+    arguments = args()
+    # Packs are independent, each one writes its own time stamped reports.
+    with ProcessPoolExecutor(max_workers=arguments.jobs) as executor:
+        for _ in executor.map(
+                partial(analyze, skip_unchanged=arguments.skip_unchanged),
+                pack_folders(location)):
+            pass
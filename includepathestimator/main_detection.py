@@ -7,7 +7,9 @@
 
 import os
 from modules import estimateincludepaths as eip
-sources = eip.source_files(r'..\components\ARM.CMSIS-FreeRTOS.10.2.0')
-for file in sources:
-    if eip.identify_main(file):
+
+# --------MAIN--------
+if __name__ == "__main__":
+    sources = eip.source_files(r'..\components\ARM.CMSIS-FreeRTOS.10.2.0')
+    for file in eip.all_main_sources(sources):
         print(file)
@@ -8,6 +8,9 @@
 import os
 from modules import estimateincludepaths as eip
 from modules import pdsccoverage as pcov
-pack = r'..\components\ARM.mbedTLS.1.6.0'
-eip.estimate_include_paths(pack)
-pcov.pdsc_coverage(pack)
+
+# --------MAIN--------
+if __name__ == "__main__":
+    pack = r'..\components\ARM.mbedTLS.1.6.0'
+    eip.estimate_include_paths(pack)
+    pcov.pdsc_coverage(pack)
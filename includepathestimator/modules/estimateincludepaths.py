@@ -8,133 +8,158 @@ This script estimates include paths from raw C source code.
 """
 
 import argparse
-import glob
+import sys
 import re
 import os
 import mmap
+import hashlib
 from pathlib import Path, PurePath
 import datetime
 import time
-from collections import OrderedDict, defaultdict, Counter
+from functools import lru_cache
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict, defaultdict, Counter, namedtuple
 import yaml
-import yamlordereddictloader
+try:
+    # libyaml based emitter is much faster, available in most PyYAML builds.
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
 
 source_types = [".cpp", ".c", ".h", ".asm", ".s", ".S"]
-known_system_includes = ['_ansi.h',
-                         '_fake_defines.h',
-                         '_fake_typedefs.h',
-                         '_syslist.h',
-                         'aio.h',
-                         'alloca.h',
-                         'ar.h',
-                         'argz.h',
-                         'assert.h',
-                         'c_types.h',
-                         'cerrno',
-                         'cmath',
-                         'complex.h',
-                         'cpio.h',
-                         'cstddef',
-                         'cstdint',
-                         'cstdio',
-                         'cstdlib',
-                         'cstring',
-                         'ctype.h',
-                         'dirent.h',
-                         'dlfcn.h',
-                         'emmintrin.h',
-                         'endian.h',
-                         'envz.h',
-                         'errno.h',
-                         'evntprov.h',
-                         'evntrace.h',
-                         'fastmath.h',
-                         'fcntl.h',
-                         'features.h',
-                         'fenv.h',
-                         'float.h',
-                         'fmtmsg.h',
-                         'fnmatch.h',
-                         'ftw.h',
-                         'getopt.h',
-                         'glob.h',
-                         'grp.h',
-                         'iconv.h',
-                         'ieeefp.h',
-                         'immintrin.h',
-                         'intrinsics.h',
-                         'inttypes.h',
-                         'iso646.h',
-                         'langinfo.h',
-                         'libgen.h',
-                         'libintl.h',
-                         'limits.h',
-                         'locale.h',
-                         'malloc.h',
-                         'math.h',
-                         'monetary.h',
-                         'mqueue.h',
-                         'ndbm.h',
-                         'netdb.h',
-                         'newlib.h',
-                         'nl_types.h',
-                         'paths.h',
-                         'poll.h',
-                         'process.h',
-                         'pthread.h',
-                         'pwd.h',
-                         'reent.h',
-                         'regdef.h',
-                         'regex.h',
-                         'sched.h',
-                         'search.h',
-                         'semaphore.h',
-                         'setjmp.h',
-                         'signal.h',
-                         'smmintrin.h',
-                         'spawn.h',
-                         'stdarg.h',
-                         'stdbool.h',
-                         'stddef.h',
-                         'stdint.h',
-                         'stdio.h',
-                         'stdlib.h',
-                         'string.h',
-                         'strings.h',
-                         'stropts.h',
-                         'sys/mkdev.h',
-                         'sys/param.h',
-                         'sys/reboot.h',
-                         'sys/resource.h',
-                         'sys/signal.h',
-                         'sys/socket.h',
-                         'sys/stat.h',
-                         'sys/syscall.h',
-                         'sys/time.h',
-                         'sys/times.h',
-                         'sys/types.h',
-                         'sys/uio.h',
-                         'sys/un.h',
-                         'sys/wait.h',
-                         'syslog.h',
-                         'tar.h',
-                         'termios.h',
-                         'tgmath.h',
-                         'time.h',
-                         'trace.h',
-                         'ulimit.h',
-                         'unctrl.h',
-                         'unistd.h',
-                         'utime.h',
-                         'utmp.h',
-                         'utmpx.h',
-                         'wchar.h',
-                         'wctype.h',
-                         'windows.h',
-                         'winsock2.h',
-                         'wmistr.h',
-                         'wordexp.h',
-                         'zlib.h']
+# Paths are always analyzed and reported in POSIX form.
+posix_separator = "/"
+# Single regex pass over whole file content, measured faster than line based
+# str.startswith() scanning which runs per line in the interpreter.
+# Anchored to preprocessor directive lines, scanned on raw bytes.
+include_regex = re.compile(
+    rb'^[ \t]*#[ \t]*include[ \t]*["<](?P<inc_path>[^">\r\n]*)', re.MULTILINE)
+# Supported main() signatures combined into single alternation:
+# void/int main(void), void/int main(), int main(int argc, char **argv)
+# and int main(int argc, char *argv[]).
+# Pattern is searched directly in file bytes, no decoding needed.
+main_regex = re.compile(
+    rb'(?:void|int)\s*main\s*\(\s*(?:void\s*)?\)\s*{'
+    rb'|int\s*main\s*\(\s*int\s*argc\s*,\s*char\s*'
+    rb'(?:\*\*\s*argv\s*|\*\s*argv\s*\[\])\)\s*{')
+# Smaller files are read at once, mapping them costs more than reading.
+mmap_size_threshold = 64 * 1024
+known_system_includes = frozenset({'_ansi.h',
+                                   '_fake_defines.h',
+                                   '_fake_typedefs.h',
+                                   '_syslist.h',
+                                   'aio.h',
+                                   'alloca.h',
+                                   'ar.h',
+                                   'argz.h',
+                                   'assert.h',
+                                   'c_types.h',
+                                   'cerrno',
+                                   'cmath',
+                                   'complex.h',
+                                   'cpio.h',
+                                   'cstddef',
+                                   'cstdint',
+                                   'cstdio',
+                                   'cstdlib',
+                                   'cstring',
+                                   'ctype.h',
+                                   'dirent.h',
+                                   'dlfcn.h',
+                                   'emmintrin.h',
+                                   'endian.h',
+                                   'envz.h',
+                                   'errno.h',
+                                   'evntprov.h',
+                                   'evntrace.h',
+                                   'fastmath.h',
+                                   'fcntl.h',
+                                   'features.h',
+                                   'fenv.h',
+                                   'float.h',
+                                   'fmtmsg.h',
+                                   'fnmatch.h',
+                                   'ftw.h',
+                                   'getopt.h',
+                                   'glob.h',
+                                   'grp.h',
+                                   'iconv.h',
+                                   'ieeefp.h',
+                                   'immintrin.h',
+                                   'intrinsics.h',
+                                   'inttypes.h',
+                                   'iso646.h',
+                                   'langinfo.h',
+                                   'libgen.h',
+                                   'libintl.h',
+                                   'limits.h',
+                                   'locale.h',
+                                   'malloc.h',
+                                   'math.h',
+                                   'monetary.h',
+                                   'mqueue.h',
+                                   'ndbm.h',
+                                   'netdb.h',
+                                   'newlib.h',
+                                   'nl_types.h',
+                                   'paths.h',
+                                   'poll.h',
+                                   'process.h',
+                                   'pthread.h',
+                                   'pwd.h',
+                                   'reent.h',
+                                   'regdef.h',
+                                   'regex.h',
+                                   'sched.h',
+                                   'search.h',
+                                   'semaphore.h',
+                                   'setjmp.h',
+                                   'signal.h',
+                                   'smmintrin.h',
+                                   'spawn.h',
+                                   'stdarg.h',
+                                   'stdbool.h',
+                                   'stddef.h',
+                                   'stdint.h',
+                                   'stdio.h',
+                                   'stdlib.h',
+                                   'string.h',
+                                   'strings.h',
+                                   'stropts.h',
+                                   'sys/mkdev.h',
+                                   'sys/param.h',
+                                   'sys/reboot.h',
+                                   'sys/resource.h',
+                                   'sys/signal.h',
+                                   'sys/socket.h',
+                                   'sys/stat.h',
+                                   'sys/syscall.h',
+                                   'sys/time.h',
+                                   'sys/times.h',
+                                   'sys/types.h',
+                                   'sys/uio.h',
+                                   'sys/un.h',
+                                   'sys/wait.h',
+                                   'syslog.h',
+                                   'tar.h',
+                                   'termios.h',
+                                   'tgmath.h',
+                                   'time.h',
+                                   'trace.h',
+                                   'ulimit.h',
+                                   'unctrl.h',
+                                   'unistd.h',
+                                   'utime.h',
+                                   'utmp.h',
+                                   'utmpx.h',
+                                   'wchar.h',
+                                   'wctype.h',
+                                   'windows.h',
+                                   'winsock2.h',
+                                   'wmistr.h',
+                                   'wordexp.h',
+                                   'zlib.h'})
 
 
 def args():
@@ -149,26 +174,66 @@ def args():
         action="store",
         help=" Absolute path to source code root folder.",
     )
+    parser.add_argument(
+        "--dump-full-db",
+        action="store_true",
+        help=" Dump full database record into yml file.",
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help=" Skip analysis if source files did not change since last run.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=None,
+        help=" Number of processes detecting main() functions, all cpus by default.",
+    )
     return parser.parse_args()
 
 
 def separator():
     """Return standard POSIX path separator."""
-    return str(PurePath(os.sep).as_posix())
+    return posix_separator
+
+
+@lru_cache(maxsize=None)
+def path_tokens(path):
+    """Split POSIX path into tuple of interned tokens. Cached, the same paths are
+    split for every analyzed include."""
+    return tuple(map(sys.intern, path.split(posix_separator)))
 
 
 def source_files(source_folder):
     """Get list of source files from source folder."""
     sources = list()
-    for source_type in source_types:
-        sources.extend(
-            glob.glob(
-                source_folder +
-                "/**/*" +
-                source_type,
-                recursive=True))
-    sources = sorted(map(lambda path: PurePath(path).as_posix(), sources))
-    return sources
+    extensions = tuple(source_types)
+    folders = [PurePath(source_folder).as_posix()]
+    # Leading "./" of scandir paths is dropped for current folder, like PurePath does.
+    prefix_length = len(os.curdir + os.sep) if folders[0] == os.curdir else 0
+    # Single scandir walk for all source types, hidden files are skipped like in glob.
+    while folders:
+        try:
+            entries = os.scandir(folders.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        folders.append(entry.path)
+                elif entry.name.endswith(extensions):
+                    sources.append(sys.intern(entry.path[prefix_length:].replace(os.sep, posix_separator)))
+    return sorted(sources)
+
+
+ClassifiedFiles = namedtuple(
+    "ClassifiedFiles", ["headers", "c_sources", "header_folders", "c_source_folders"])
 
 
 def header_files(file_list):
@@ -183,43 +248,68 @@ def c_source_files(file_list):
 
 def header_folders(file_list):
     """List folders containing header files"""
-    return sorted(set(map(lambda file: PurePath(
-        file).parent.as_posix(), header_files(file_list))))
+    return classify_files(file_list).header_folders
 
 
 def c_source_folders(file_list):
     """List folders containing c source files"""
-    return sorted(set(map(lambda file: PurePath(
-        file).parent.as_posix(), c_source_files(file_list))))
+    return classify_files(file_list).c_source_folders
+
+
+def classify_files(file_list):
+    """Split source files list into header files, c source files and their folders
+    in single pass. Returns ClassifiedFiles with the same lists as header_files(),
+    c_source_files(), header_folders() and c_source_folders()."""
+    headers = set()
+    c_sources = set()
+    header_dirs = set()
+    c_source_dirs = set()
+    for file in file_list:
+        if file.endswith(".h"):
+            headers.add(file)
+            header_dirs.add(file.rsplit(posix_separator, 1)[0])
+        elif file.endswith(".c"):
+            c_sources.add(file)
+            c_source_dirs.add(file.rsplit(posix_separator, 1)[0])
+    return ClassifiedFiles(
+        sorted(headers), sorted(c_sources), sorted(header_dirs), sorted(c_source_dirs))
+
+
+def includes_by_file(file_list):
+    """Extract includes of all source files in parallel threads.
+    File reading dominates the analysis, so threads are sufficient."""
+    with ThreadPoolExecutor() as executor:
+        return dict(zip(file_list, executor.map(includes_from_file, file_list)))
 
 
 def includes(file_list):
     """Extract list of includes used in each source file and attach it in data structure."""
     return sorted(
-        {include for file in file_list for include in includes_from_file(file)}
+        {include for file_includes in includes_by_file(file_list).values()
+         for include in file_includes}
     )
 
 
 def includes_with_count(file_list):
     """Count includes used in source files."""
     counted_includes = Counter(
-        [include for file in file_list for include in includes_from_file(file)]
+        [include for file_includes in includes_by_file(file_list).values()
+         for include in file_includes]
     )
-    return OrderedDict(counted_includes.most_common())
+    # Most used includes first, includes with equal count in alphabetical order.
+    return OrderedDict(sorted(counted_includes.items(), key=lambda item: (-item[1], item[0])))
 
 
 def internal_includes(include_list, file_list):
     """Return includes which could be mapped to internal source files
     (files in root folder and its sub folders). """
+    files = header_index(file_list)
     internal_include_list = list()
     for include in include_list:
-        include_tokens = include.split(separator())
-        up_reference_count = include_tokens.count("..")
-        for file in file_list:
-            file_tokens = file.split(separator())
-            if file_tokens[-len(include_tokens) +
-                           up_reference_count:] == include_tokens[up_reference_count:]:
-                internal_include_list.append(include)
+        include_tokens = path_tokens(include)
+        # Include path without upper level references must end some file path.
+        if headers_with_suffix(files, include_tokens[include_tokens.count(".."):]):
+            internal_include_list.append(include)
     return sorted(set(internal_include_list))
 
 
@@ -243,26 +333,26 @@ def up_level_references_folders(
 ):
     """Get folders in scope of upper level references."""
     ambiguous_paths = list()
-    subfolders = [path for path in os.scandir(
-        include_path_candidate) if path.is_dir()]
-    for path in subfolders:
-        path = PurePath(path).as_posix()
-        path_tokens = path.split(separator())
-        origin_path_length = len(header_tokens) - 1
-        if (len(path_tokens) > origin_path_length) and (
-            len(path_tokens) <= origin_path_length + up_reference_count
-        ):
-            if path not in ambiguous_paths:
-                ambiguous_paths.append(path)
+    origin_path_length = len(header_tokens) - 1
+    # All sub folders have the same path length, so it is tested before the scan.
+    folder_path_length = len(path_tokens(include_path_candidate)) + 1
+    if (folder_path_length > origin_path_length) and (
+        folder_path_length <= origin_path_length + up_reference_count
+    ):
+        with os.scandir(include_path_candidate) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    ambiguous_paths.append(
+                        sys.intern(entry.path.replace(os.sep, posix_separator)))
     return ambiguous_paths
 
 
 def record_header(database, header):
-    """ambiguous_pathAdd header file into include path candidates database."""
-    if header not in database.keys():
-        database[header] = {"include_paths": []}
-    if "path_notes" not in database[header].keys():
-        database[header]["path_types"] = []
+    """Add header file into include path candidates database."""
+    # Database is created per single include and each header is matched only
+    # once, so the lists hold one candidate and stay fast for membership tests.
+    # Lists are kept as they are dumped into the full database record.
+    database.setdefault(header, {"include_paths": [], "path_types": []})
     return database
 
 
@@ -303,154 +393,177 @@ def record_mandatory_paths(database, include_path_candidate, header):
     return database
 
 
+def header_index(headers):
+    """Index header files in trie of reversed path tokens for fast include lookups.
+    Trie node is a pair of child nodes dictionary and list of headers ending
+    with tokens leading to the node. Each header is stored together with its
+    tokens and folder."""
+    index = (dict(), list())
+    for header_file in headers:
+        header_tokens = path_tokens(header_file)
+        header = (header_file, header_tokens, header_file.rpartition(posix_separator)[0])
+        node = index
+        for token in reversed(header_tokens):
+            node = node[0].setdefault(token, (dict(), list()))
+            node[1].append(header)
+    return index
+
+
+def headers_with_suffix(index, tokens):
+    """Return headers from header_index() with path ending by tokens."""
+    node = index
+    for token in reversed(tokens):
+        node = node[0].get(token)
+        if node is None:
+            return ()
+    return node[1]
+
+
 def include_paths_for_include(source, include, headers):
-    """Estimate include paths for single include in source file and mapped header file."""
-    database = defaultdict(list)
+    """Estimate include paths for single include in source file and mapped header file.
+    Headers are expected as index created by header_index()."""
+    database = dict()
     up_reference_count = 0
     ambiguous_paths = list()
     # Find if include in source_file could be mapped to some internal header
     # path.
-    source_tokens = source.split(separator())
-    include_tokens = include.split(separator())
+    source_folder = source.rpartition(posix_separator)[0]
+    include_tokens = path_tokens(include)
     # Upper level references might result in multiple possible include paths.
     up_reference_count = include_tokens.count("..")
-    for header_file in headers:
-        header_tokens = header_file.split(separator())
-        # Test if there is existing internal header matching specific include.
-        if (
-            header_tokens[-len(include_tokens) + up_reference_count:]
-            == include_tokens[up_reference_count:]
-        ):
-            # Determine path to header according to specific include without
-            # upper level references '..'.
-            include_path_candidate = separator().join(
-                header_tokens[: -len(include_tokens) + up_reference_count]
+    # Existing internal headers matching specific include.
+    for header_file, header_tokens, header_folder in headers_with_suffix(
+            headers, include_tokens[up_reference_count:]):
+        # Determine path to header according to specific include without
+        # upper level references '..'. The same candidate is built for many
+        # includes, interned copy makes later membership tests cheap.
+        include_path_candidate = sys.intern(posix_separator.join(
+            header_tokens[: -len(include_tokens) + up_reference_count]
+        ))
+        database = record_header(database, header_file)
+        if up_reference_count > 0:
+            ambiguous_paths = up_level_references_folders(
+                include_path_candidate, up_reference_count, header_tokens
             )
-            database = record_header(database, header_file)
-            if up_reference_count > 0:
-                ambiguous_paths = up_level_references_folders(
-                    include_path_candidate, up_reference_count, header_tokens
-                )
-                database = record_ambiguous_paths(
-                    database, ambiguous_paths, header_file
+            database = record_ambiguous_paths(
+                database, ambiguous_paths, header_file
+            )
+        else:
+            # in context record should be mandatory include paths even if
+            # there is system alternative
+            if not header_folder == source_folder:
+                database = record_mandatory_paths(
+                    database, include_path_candidate, header_file
                 )
             else:
-                # in context record should be mandatory include paths even if
-                # there is system alternative
-                if not header_tokens[:-1] == source_tokens[:-1]:
-                    database = record_mandatory_paths(
-                        database, include_path_candidate, header_file
-                    )
-                else:
-                    database = record_optional_paths(
-                        database, include_path_candidate, header_file
-                    )
+                database = record_optional_paths(
+                    database, include_path_candidate, header_file
+                )
         ambiguous_paths = list()
     return database
 
 
 def includes_from_file(file):
-    """Extract includes used in source files by regex analysis."""
+    """Extract includes used in source files by regex analysis.
+    Results are cached per file and its modification time, the same sources
+    are analyzed by several reports and modified files are analyzed again."""
+    if not file.lower().endswith(tuple(source_types)):
+        return tuple()
+    return cached_includes_from_file(file, os.stat(file).st_mtime_ns)
+
+
+@lru_cache(maxsize=None)
+def cached_includes_from_file(file, modification_time):
+    """Extract includes from specific version of source file, see includes_from_file()."""
     file_includes = list()
-    include_regex = r'#include ["<](?P<inc_path>[^">]*)'
-    if file.lower().endswith(tuple(source_types)):
-        with open(file, "r", encoding="utf-8", errors="ignore") as file_data:
-            for line in file_data:
-                match = re.search(include_regex, line)
-                if match:
-                    include = match.group("inc_path")
-                    file_includes.append(include)
-    return sorted(file_includes)
+    with open(file, "rb") as file_data:
+        data = file_data.read()
+    # Skip regex analysis of files without any include, only matches are decoded.
+    if b"include" in data:
+        file_includes = [
+            sys.intern(match.group("inc_path").decode(encoding="utf-8", errors="ignore"))
+            for match in include_regex.finditer(data)]
+    # Includes are kept in file order, callers sort only where order matters.
+    return tuple(file_includes)
 
 
 def identify_main(file):
     """Extract includes used in source files by regex analysis."""
     # TODO: eliminate main functions in comments.
     status = False
-    regex = [r'void\s*main\s*\(\s*void\s*\)\s*{',
-             r'int\s*main\s*\(\s*void\s*\)\s*{',
-             r'void\s*main\s*\(\s*\)\s*{',
-             r'int\s*main\s*\(\s*\)\s*{',
-             r'int\s*main\s*\(\s*int\s*argc\s*,\s*char\s*\*\*\s*argv\s*\)\s*{',
-             r'int\s*main\s*\(\s*int\s*argc\s*,\s*char\s*\*\s*argv\s*\[\]\)\s*{']
     if file.lower().endswith(tuple([".c",".cpp"])):
-        with open(file, "r+") as f:
-            data = mmap.mmap(f.fileno(), 0).read().decode(encoding="utf-8",errors='ignore')
-            for r in regex:
-                if re.search(r, data):
-                    status = True
-                    break
+        with open(file, "rb") as f:
+            if os.fstat(f.fileno()).st_size < mmap_size_threshold:
+                status = main_regex.search(f.read()) is not None
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    status = main_regex.search(data) is not None
     return status
 
-def all_main_sources(sources):
-    """List all source files with main() function."""
-    sources_with_main = list()
-    for file in sources:
-        if identify_main(file):
-            sources_with_main.append(file)
-    return sources_with_main
-
-
-def get_root(database):
-    """Load root folder from database."""
-    return list(database.keys())[0]
-
 
-def get_sources(database, root):
-    """Load source list from database."""
-    return database[root]["source_files"]
+def main_detection_executor(jobs=None):
+    """Create process pool for main() function detection with jobs workers.
+    Single job needs no pool, e.g. in batch_run workers which are processes already."""
+    if jobs == 1:
+        return nullcontext()
+    return ProcessPoolExecutor(max_workers=jobs)
 
 
-def get_includes(database, root, source):
-    """Load source file specific includes from database."""
-    return database[root]["source_files"][source]["includes"]
+def submit_main_detection(executor, sources):
+    """Submit main() function detection of all sources to process pool executor.
+    Sources are analyzed in background, statuses are returned in sources order.
+    Without executor statuses are detected in current process when iterated."""
+    if executor is None:
+        return map(identify_main, sources)
+    chunk_size = max(1, len(sources) // ((os.cpu_count() or 1) * 4))
+    return executor.map(identify_main, sources, chunksize=chunk_size)
 
 
-def get_headers(database, root, source, include):
-    """Load header files mapped to specific include and source file."""
-    return database[root]["source_files"][source]["includes"][include]["mapped_headers"]
+def all_main_sources(sources, jobs=None):
+    """List all source files with main() function.
+    Regex analysis is CPU bound, files are analyzed in jobs parallel processes."""
+    with main_detection_executor(jobs) as executor:
+        statuses = submit_main_detection(executor, sources)
+        return [file for file, status in zip(sources, statuses) if status]
 
 
-def get_include_paths(database, root, source, include, header):
-    """Load include paths estimated for specific include, source file
-    and mapped header file."""
-    return database[root]["source_files"][source]["includes"][include][
-        "mapped_headers"
-    ][header]["include_paths"]
-
-
-def get_include_types(database, root, source, include, header):
-    """Load include paths type estimated for specific include, source file
-    and mapped header file."""
-    return database[root]["source_files"][source]["includes"][include][
-        "mapped_headers"
-    ][header]["path_types"][0]
-
-
-def assign_types(paths, database, root, source, include, header, path):
-    """Assign identified include path types for specific include path."""
-    path_type = get_include_types(database, root, source, include, header)
-    if "non_existing" not in path_type:
-        if path not in paths.keys():
-            paths[path] = {"types": []}
-        if path_type not in paths[path]["types"]:
-            paths[path]["types"].append(path_type)
+def get_root(database):
+    """Load root folder from database."""
+    return next(iter(database))
+
+
+def record_path_types(paths, mapped_headers):
+    """Add include paths of mapped headers with their type into paths report."""
+    for header_record in mapped_headers.values():
+        path_type = header_record["path_types"][0]
+        if "non_existing" in path_type:
+            continue
+        for path in header_record["include_paths"]:
+            path_types = paths.setdefault(path, {"types": []})["types"]
+            if path_type not in path_types:
+                path_types.append(path_type)
     return paths
 
 
 def paths_report(database):
     """Generate summarized include paths report per each source file."""
-    database = defaultdict(list, database)
     paths = dict()
     root = get_root(database)
-    for source in get_sources(database, root):
-        for include in get_includes(database, root, source):
-            for header in get_headers(database, root, source, include):
-                for path in get_include_paths(
-                        database, root, source, include, header):
-                    paths = assign_types(
-                        paths, database, root, source, include, header, path
-                    )
+    for source_record in database[root]["source_files"].values():
+        for include_record in source_record["includes"].values():
+            paths = record_path_types(paths, include_record["mapped_headers"])
+    return paths
+
+
+def stream_paths_report(sources, headers):
+    """Generate the same report as paths_report() directly from source files.
+    Include paths are estimated on the fly, without full database record."""
+    paths = dict()
+    headers = header_index(headers)
+    for source in sources:
+        for include in sorted(set(includes_from_file(source))):
+            paths = record_path_types(
+                paths, include_paths_for_include(source, include, headers))
     return paths
 
 
@@ -458,7 +571,8 @@ def path_types_report(paths):
     """Generate include paths classified by type report
     Generated from paths report."""
     report = defaultdict(list)
-    for path in paths:
+    # Paths are classified in sorted order, type lists are created sorted.
+    for path in sorted(paths):
         types = paths[path]["types"]
         if "mandatory" in types:
             report["mandatory"].append(path)
@@ -466,28 +580,35 @@ def path_types_report(paths):
             report["optional"].append(path)
         if "ambiguous" in types and "mandatory" not in types:
             report["ambiguous"].append(path)
-    if "mandatory" in report.keys():
-        report["mandatory"] = sorted(report["mandatory"])
-    if "optional" in report.keys():
-        report["optional"] = sorted(report["optional"])
-    if "ambiguous" in report.keys():
-        report["ambiguous"] = sorted(report["ambiguous"])
     return report
 
 
 def print_list(some_list, file):
     """Print list elements in new lines."""
-    print(*some_list, sep="\n", file=file)
+    # Joined first, whole list is written in single call.
+    print("\n".join(map(str, some_list)), file=file)
 
 
-class NoAliasDumper(yaml.Dumper):
+class NoAliasDumper(SafeDumper):
     """Helper yml dumper to disable yml aliases.
-    Workaround for known issue based on https://github.com/yaml/pyyaml/issues/103"""
+    Workaround for known issue based on https://github.com/yaml/pyyaml/issues/103
+    Based on libyaml C emitter if available, ordered dictionaries are dumped
+    as plain mappings in insertion order."""
 
     def ignore_aliases(self, data):
         return True
 
 
+NoAliasDumper.add_representer(
+    OrderedDict, lambda dumper, data: dumper.represent_dict(data.items()))
+
+
+def dump_yaml(data, file_name):
+    """Dump data object into yml file."""
+    with open(file_name, 'w') as report_file:
+        yaml.dump(data, report_file, Dumper=NoAliasDumper, width=1000)
+
+
 def record_root(database, root):
     """Save source root folder into database record."""
     database[root] = {}
@@ -516,65 +637,71 @@ def record_includes(database):
 def record_include_paths(database, headers):
     """Save estimated include paths mapped to each include into database record"""
     root = get_root(database)
+    headers = header_index(headers)
     for source in database[root]["source_files"]:
         for include in database[root]["source_files"][source]["includes"]:
             paths = include_paths_for_include(source, include, headers)
             database[root]["source_files"][source]["includes"][include] = {
-                "mapped_headers": dict(paths)
+                "mapped_headers": paths
             }
     return database
 
 
 def record_include_types(database, internal_include_list):
     """Save estimated include types into database record"""
-    #database = defaultdict(list, database)
     root = get_root(database)
-    for source in database[root]["source_files"].keys():
-        for include in database[root]["source_files"][source]["includes"].keys(
-        ):
-            if "include_type" not in database[root]["source_files"][source]["includes"][include].keys(
-            ):
-                database[root]["source_files"][source]["includes"][include]["include_type"] = [
-                ]
+    # Set lookup, the include list is tested for every include of every source.
+    internal_include_set = set(internal_include_list)
+    # Records are bound to locals, deep lookup chains are not repeated.
+    for source_record in database[root]["source_files"].values():
+        for include, include_record in source_record["includes"].items():
+            include_type = include_record.setdefault("include_type", [])
             if include in known_system_includes:
-                if "system" not in database[root]["source_files"][source]["includes"][include]["include_type"]:
-                    database[root]["source_files"][source]["includes"][include]["include_type"].append(
-                        "system")
-            if include in internal_include_list:
-                if "internal" not in database[root]["source_files"][source]["includes"][include]["include_type"]:
-                    database[root]["source_files"][source]["includes"][include]["include_type"].append(
-                        "internal")
+                if "system" not in include_type:
+                    include_type.append("system")
+            if include in internal_include_set:
+                if "internal" not in include_type:
+                    include_type.append("internal")
             else:
-                if "external" not in database[root]["source_files"][source]["includes"][include]["include_type"]:
-                    database[root]["source_files"][source]["includes"][include]["include_type"].append(
-                        "external")
+                if "external" not in include_type:
+                    include_type.append("external")
     return database
 
 
-def console_print(include_paths_by_type):
-    """Print estimated include paths into console."""
-    if "mandatory" in include_paths_by_type.keys():
-        print("\nMandatory paths:")
-        print("------------------------")
-        for path in include_paths_by_type["mandatory"]:
-            print(path)
+def console_print(include_paths_by_type, file=None, caption="paths"):
+    """Print estimated include paths into console (or into report file)."""
+    for path_type in ("mandatory", "optional", "ambiguous"):
+        if path_type in include_paths_by_type:
+            print("\n{0:s} {1:s}:".format(path_type.capitalize(), caption), file=file)
+            print("------------------------", file=file)
+            print_list(include_paths_by_type[path_type], file=file)
+
 
-    if "optional" in include_paths_by_type.keys():
-        print("\nOptional paths:")
-        print("------------------------")
-        for path in include_paths_by_type["optional"]:
-            print(path)
+def clear_caches():
+    """Drop cached include and path analysis results.
+    Called after each analyzed tree, batch runs would accumulate entries of all packs."""
+    cached_includes_from_file.cache_clear()
+    path_tokens.cache_clear()
 
-    if "ambiguous" in include_paths_by_type.keys():
-        print("\nAmbiguous paths:")
-        print("------------------------")
-        for path in include_paths_by_type["ambiguous"]:
-            print(path)
+
+def sources_fingerprint(sources, *options):
+    """Hash source file paths, sizes and modification times together with
+    analysis options."""
+    digest = hashlib.sha256(repr(options).encode("utf-8"))
+    for source in sources:
+        stat = os.stat(source)
+        digest.update("{0:s}\0{1:d}\0{2:d}\n".format(
+            source, stat.st_mtime_ns, stat.st_size).encode("utf-8", errors="surrogateescape"))
+    return digest.hexdigest()
 
 
-def estimate_include_paths(root):
-    """Extract data and create final reports."""
-    database = defaultdict(list)
+def estimate_include_paths(root, dump_full_db=False, skip_unchanged=False, jobs=None):
+    """Extract data and create final reports.
+    Full database record is dumped only on request, it is by far the largest report.
+    With skip_unchanged the analysis is skipped if there is a marker of previous
+    run on identical sources in .iep_cache folder of the root.
+    Main functions are detected in jobs processes, single job runs in current process."""
+    database = dict()
 
     start_time = time.time()
 
@@ -582,67 +709,62 @@ def estimate_include_paths(root):
     time_now = now.strftime("%Y-%m-%d_%H-%M-%S")
 
     sources = source_files(root)
-    headers = header_files(sources)
+
+    if skip_unchanged:
+        marker = os.path.join(
+            root, ".iep_cache", sources_fingerprint(sources, dump_full_db) + ".done")
+        if os.path.isfile(marker):
+            print("\nSources not changed since last run, skipping:", root)
+            return
+
+    classified = classify_files(sources)
+    headers = classified.headers
     includes_list = includes(sources)
 
     root = Path(root).as_posix()
-    database = record_root(database, root)
-    database = record_sources(database, sources)
-    database = record_includes(database)
-    database = record_include_paths(database, headers)
-
     internal_include_list = internal_includes(includes_list, headers)
-    database = record_include_types(database, internal_include_list)
 
-    summarized_include_paths = paths_report(database)
+    # Full database record is built only if it is dumped.
+    if dump_full_db:
+        database = record_root(database, root)
+        database = record_sources(database, sources)
+        database = record_includes(database)
+        database = record_include_paths(database, headers)
+        database = record_include_types(database, internal_include_list)
+        summarized_include_paths = paths_report(database)
+    else:
+        summarized_include_paths = stream_paths_report(sources, headers)
     include_paths_by_type = path_types_report(summarized_include_paths)
 
-    #include_paths_by_include = include_path_by_include_report(database)
-
     print("\n--- INCLUDE PATH ESTIMATION ---")
     console_print(include_paths_by_type)
 
     target_name = os.path.basename(os.path.normpath(root))
 
-    # Dump database objects into yml files
-    file_name = '{0:s}_raw_{1:s}_include_statistics.yml'.format(
-        time_now, target_name)
-    with open(file_name, 'w') as report_file:
-        yaml.dump(
-            includes_with_count(sources),
-            report_file,
-            Dumper=yamlordereddictloader.Dumper,
-            width=1000,
-        )
+    # Main functions are detected by worker processes while yml files are dumped,
+    # emitting yml holds the GIL so the dumps would not overlap in threads.
+    with main_detection_executor(jobs) as executor:
+        main_statuses = submit_main_detection(executor, sources)
 
-    file_name = '{0:s}_raw_{1:s}_list_of_include_paths.yml'.format(
-        time_now, target_name)
-    with open(file_name, 'w') as report_file:
-        yaml.dump(
+        # Dump database objects into yml files
+        dump_yaml(
+            includes_with_count(sources),
+            '{0:s}_raw_{1:s}_include_statistics.yml'.format(time_now, target_name))
+        dump_yaml(
             dict(summarized_include_paths),
-            report_file,
-            Dumper=NoAliasDumper,
-            width=1000)
-
-    file_name = '{0:s}_raw_{1:s}_list_of_include_path_types.yml'.format(
-        time_now, target_name)
-    with open(file_name, 'w') as report_file:
-        yaml.dump(
+            '{0:s}_raw_{1:s}_list_of_include_paths.yml'.format(time_now, target_name))
+        dump_yaml(
             dict(include_paths_by_type),
-            report_file,
-            Dumper=NoAliasDumper,
-            width=1000)
+            '{0:s}_raw_{1:s}_list_of_include_path_types.yml'.format(time_now, target_name))
+        if dump_full_db:
+            dump_yaml(
+                dict(database),
+                '{0:s}_raw_{1:s}_full_database_record.yml'.format(time_now, target_name))
 
-    file_name = '{0:s}_raw_{1:s}_full_database_record.yml'.format(
-        time_now, target_name)
-    with open(file_name, 'w') as report_file:
-        yaml.dump(
-            dict(database),
-            report_file,
-            Dumper=NoAliasDumper,
-            width=1000)
-
-    end_time = time.time()
+        # Execution time does not include main() detection, as before.
+        end_time = time.time()
+        sources_with_main = [
+            file for file, status in zip(sources, main_statuses) if status]
 
     # Create verbose report
     file_name = '{0:s}_raw_{1:s}_verbose_report.txt'.format(
@@ -656,31 +778,11 @@ def estimate_include_paths(root):
                 datetime.timedelta(
                     seconds=end_time - start_time)))
 
-        if "mandatory" in include_paths_by_type.keys():
-            print("\nMandatory include paths:", file=report_file)
-            print("------------------------", file=report_file)
-            for path in include_paths_by_type["mandatory"]:
-                print(path, file=report_file)
-
-        if "optional" in include_paths_by_type.keys():
-            print("\nOptional include paths:", file=report_file)
-            print("------------------------", file=report_file)
-            for path in include_paths_by_type["optional"]:
-                print(path, file=report_file)
-
-        if "ambiguous" in include_paths_by_type.keys():
-            print("\nAmbiguous include paths:", file=report_file)
-            print("------------------------", file=report_file)
-            for path in include_paths_by_type["ambiguous"]:
-                print(path, file=report_file)
+        console_print(include_paths_by_type, report_file, "include paths")
 
         print("\nCommon include path prefix:", file=report_file)
         print("------------------------", file=report_file)
-        print(
-            os.path.commonprefix(
-                list(
-                    summarized_include_paths.keys())),
-            file=report_file)
+        print(os.path.commonprefix(list(summarized_include_paths)), file=report_file)
 
         print("\nInternal include list:", file=report_file)
         print("------------------------", file=report_file)
@@ -700,7 +802,7 @@ def estimate_include_paths(root):
 
         print("\nC source file list:", file=report_file)
         print("------------------------", file=report_file)
-        print_list(c_source_files(sources), file=report_file)
+        print_list(classified.c_sources, file=report_file)
 
         print("\nHeader file list:", file=report_file)
         print("------------------------", file=report_file)
@@ -708,19 +810,27 @@ def estimate_include_paths(root):
 
         print("\nHeader folder list:", file=report_file)
         print("------------------------", file=report_file)
-        print_list(header_folders(sources), file=report_file)
+        print_list(classified.header_folders, file=report_file)
 
         print("\nC source folder list:", file=report_file)
         print("------------------------", file=report_file)
-        print_list(c_source_folders(sources), file=report_file)
+        print_list(classified.c_source_folders, file=report_file)
 
 
-        sources_with_main = all_main_sources(sources)
         print("\nC and CPP sources with main():", file=report_file)
         print("------------------------", file=report_file)
         print_list(sources_with_main, file=report_file)
 
+    if skip_unchanged:
+        os.makedirs(os.path.dirname(marker), exist_ok=True)
+        with open(marker, 'w'):
+            pass
+
+    clear_caches()
+
+
 # --------MAIN--------
 if __name__ == "__main__":
-    source_root = args().root
-    estimate_include_paths(source_root)
+    arguments = args()
+    estimate_include_paths(
+        arguments.root, arguments.dump_full_db, arguments.skip_unchanged, arguments.jobs)
@@ -9,11 +9,18 @@ This script provides description coverage of source code in cmsis pack, expresse
 
 import os
 import argparse
-import glob
-import xml.etree.ElementTree as ET
-from pathlib import Path, PurePath
+try:
+    # lxml parses pdsc files considerably faster, optional dependency.
+    from lxml import etree as ET
+    # Whitespace only text and ID attributes are never used by the analysis.
+    pdsc_parser_options = dict(remove_blank_text=True, collect_ids=False, huge_tree=True)
+except ImportError:
+    import xml.etree.ElementTree as ET
+    pdsc_parser_options = dict()
+from pathlib import PurePath
 import datetime
 import time
+from functools import lru_cache
 
 from modules import estimateincludepaths as eip
 
@@ -22,7 +29,7 @@ def args():
     """Load arguments from command line."""
     parser = argparse.ArgumentParser(
         description="Show *.pdsc description coverage.",
-        epilog=r"Example: python pdsccoverage.py -p c:/components/ARM.mbedTLS.1.6.0",
+        epilog=r"Example: python -m modules.pdsccoverage -p c:/components/ARM.mbedTLS.1.6.0",
     )
     parser.add_argument(
         "-p",
@@ -33,64 +40,81 @@ def args():
     return parser.parse_args()
 
 
-def pdsc_include_paths(file_name):
+def parse_pdsc(file_name):
+    """Extract pdsc content used by pdsc_* functions, see cached_parse_pdsc().
+    Results are cached per file and its modification time, packs analyzed
+    again in the same process are not parsed again."""
+    return cached_parse_pdsc(file_name, os.stat(file_name).st_mtime_ns)
+
+
+@lru_cache(maxsize=64)
+def cached_parse_pdsc(file_name, modification_time):
+    """Extract pdsc content used by pdsc_* functions in single streamed pass.
+    Elements are selected by their ancestors, the same way as by paths
+    ./components//component/files/file, ./components//component,
+    ./components/bundle and ./examples/example, regardless of namespace.
+    Processed elements are cleared."""
+    content = {"header": [], "include": [], "source": [],
+               "components": [], "bundles": [], "examples": []}
+    ancestors = list()
+    for event, element in ET.iterparse(file_name, ("start", "end"), **pdsc_parser_options):
+        if event == "end":
+            ancestors.pop()
+            element.clear()
+            continue
+        # Local names are compared, pdsc might declare default namespace.
+        tag = element.tag.rpartition("}")[2]
+        ancestors.append(tag)
+        depth = len(ancestors)
+        if depth < 3:
+            continue
+        if ancestors[1] == "components":
+            if tag == "file":
+                if depth >= 5 and ancestors[-2] == "files" and ancestors[-3] == "component":
+                    category = element.get("category")
+                    if category in ("header", "include", "source"):
+                        content[category].append(element.attrib["name"])
+            elif tag == "component":
+                content["components"].append(dict(element.attrib))
+            elif tag == "bundle" and depth == 3:
+                content["bundles"].append(dict(element.attrib))
+        elif ancestors[1] == "examples" and tag == "example" and depth == 3:
+            content["examples"].append(element.attrib["name"])
+    return content
+
+
+def pdsc_include_paths(pdsc_content):
     """Extract include paths from pdsc."""
-    include_paths = list()
-    tree = ET.parse(file_name)
-    xml_root = tree.getroot()
-    for file in xml_root.findall(
-            "./components//component/files/file/[@category='header']"):
-        include_tokens = file.attrib['name'].split(eip.separator())
-        include_path_candidate = eip.separator().join(include_tokens[:-1])
-        include_paths.append(include_path_candidate)
-    for file in xml_root.findall(
-            "./components//component/files/file/[@category='include']"):
-        include_paths.append(file.attrib['name'])
-    include_paths = sorted(
-        set(map(lambda include_path: PurePath(include_path).as_posix(), include_paths)))
+    include_paths = set()
+    for file_name in pdsc_content["header"]:
+        include_path_candidate = file_name.rpartition(eip.posix_separator)[0]
+        include_paths.add(include_path_candidate)
+    include_paths.update(pdsc_content["include"])
+    # Headers share few folders, only distinct paths are normalized. PurePath
+    # also resolves trailing separators and empty paths, plain replace would not.
+    include_paths = sorted({PurePath(include_path).as_posix() for include_path in include_paths})
     return include_paths
 
 
-def pdsc_sources(file_name):
+def pdsc_sources(pdsc_content):
     """Extract source files from pdsc."""
-    sources = list()
-    tree = ET.parse(file_name)
-    xml_root = tree.getroot()
-    for file in xml_root.findall(
-            "./components//component/files/file/[@category='source']"):
-        sources.append(file.attrib['name'])
-    sources = sorted(set(sources))
+    sources = sorted(set(pdsc_content["source"]))
     return sources
 
 
-def pdsc_components(file_name):
+def pdsc_components(pdsc_content):
     """Extract components from pdsc."""
-    components = list()
-    tree = ET.parse(file_name)
-    xml_root = tree.getroot()
-    for file in xml_root.findall("./components//component"):
-        components.append(file.attrib)
-    return components
+    return pdsc_content["components"]
 
 
-def pdsc_bundles(file_name):
+def pdsc_bundles(pdsc_content):
     """Extract bundles from pdsc."""
-    bundles = list()
-    tree = ET.parse(file_name)
-    xml_root = tree.getroot()
-    for file in xml_root.findall("./components/bundle"):
-        bundles.append(file.attrib)
-    return bundles
+    return pdsc_content["bundles"]
 
 
-def pdsc_examples(file_name):
+def pdsc_examples(pdsc_content):
     """Extract examples from pdsc"""
-    examples = list()
-    tree = ET.parse(file_name)
-    xml_root = tree.getroot()
-    for file in xml_root.findall("./examples/example"):
-        examples.append(file.attrib['name'])
-    return examples
+    return pdsc_content["examples"]
 
 
 def all_headers(root_path):
@@ -104,67 +128,121 @@ def all_sources(root_path):
     """ List all source files (except *.h files) in root path. """
     sources = eip.source_files(root_path)
     headers = eip.header_files(sources)
-    sources = set(sources) - set(headers)
+    sources = set(sources).difference(headers)
     return sources
 
 
-def headers_in_paths_scope(include_paths, includes_list, root_path):
+def headers_in_paths_scope(include_paths, includes_list, root_path, sources):
     """ Compare known header files with known includes from
-        source files (up-level references "../" included) and include paths defined in pdsc."""
-    visible_headers_via_includes = list()
-    header_files = list()
-    # Identify header files visible via includes (might be relative path or "..").
-    for include_path in include_paths:
-        for include in includes_list:
-            candidate = os.path.normpath(
-                root_path +
-                eip.separator() +
-                include_path +
-                eip.separator() +
-                include)
-            candidate = PurePath(candidate).as_posix()
-            if Path(candidate).is_file():
-                visible_headers_via_includes.append(candidate)
-    # identify directly visible header files
+        source files (up-level references "../" included) and include paths defined in pdsc.
+        Includes are resolved against known source files, not probed on disk."""
+    visible_headers_via_includes = set()
+    # Normalized paths are converted by plain replace, no PurePath objects needed.
+    existing_sources = {os.path.normpath(source).replace(os.sep, eip.posix_separator)
+                        for source in sources}
+    # Include could match only if its file name is name of some source file,
+    # unless upper level reference or dot token changes the name.
+    source_names = {source.rpartition(eip.posix_separator)[2] for source in existing_sources}
+    source_names.update(("", ".", ".."))
+    includes_list = [
+        include for include in includes_list
+        if include.replace(os.sep, eip.posix_separator).rpartition(eip.posix_separator)[2]
+        in source_names]
+    locations = set()
     for include_path in include_paths:
-        location = os.path.normpath(root_path + eip.separator() + include_path)
-        location = PurePath(location).as_posix()
-        header_files = headers_in_folder(location)
-        visible_headers_via_includes.extend(header_files)
-    return sorted(set(visible_headers_via_includes))
+        location = os.path.normpath(root_path + eip.posix_separator + include_path)
+        location = location.replace(os.sep, eip.posix_separator)
+        locations.add(location)
+        # identify directly visible header files
+        visible_headers_via_includes.update(headers_in_folder(location))
+    # Plain includes without '.', '..' or empty tokens are not changed by
+    # normalization, so they are simply appended to normalized locations.
+    plain_includes = list()
+    other_includes = list()
+    for include in includes_list:
+        if (not {"", ".", ".."}.intersection(include.split(eip.posix_separator))
+                and (os.sep == eip.posix_separator or os.sep not in include)):
+            plain_includes.append(include)
+        else:
+            other_includes.append(include)
+    # Root folders are not simply joined with include by separator.
+    root_locations = locations.intersection(
+        (".", eip.posix_separator, eip.posix_separator * 2))
+    for location in locations.difference(root_locations):
+        include_prefix = location + eip.posix_separator
+        visible_headers_via_includes.update(existing_sources.intersection(
+            [include_prefix + include for include in plain_includes]))
+    # Identify header files visible via includes (might be relative path or "..").
+    for location in locations:
+        if location in root_locations:
+            location_includes = includes_list
+        else:
+            location_includes = other_includes
+        for include in location_includes:
+            candidate = os.path.normpath(location + eip.posix_separator + include).replace(
+                os.sep, eip.posix_separator)
+            if candidate in existing_sources:
+                visible_headers_via_includes.add(candidate)
+    # Set is returned, sorted only for the report.
+    return visible_headers_via_includes
 
 
 def full_path(root_path, paths):
     """Combine pdsc file paths with root folder path to form absolute path."""
-    return sorted({PurePath(root_path + eip.separator() + p).as_posix()
-                  for p in paths})
+    prefix = root_path + eip.posix_separator
+    return sorted({PurePath(prefix + p).as_posix() for p in paths})
 
 
 def headers_in_folder(folder):
     """Get list of header files from single folder."""
     headers = list()
-    headers.extend(glob.glob(folder + eip.separator() + "*.h"))
-    headers = sorted(map(lambda path: PurePath(path).as_posix(), headers))
-    return headers
+    # Leading "./" of scandir paths is dropped for current folder, like PurePath does.
+    prefix_length = len(os.curdir + os.sep) if folder == os.curdir else 0
+    # Directory entries carry file type, no glob pattern matching or stat needed.
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if (entry.name.endswith(".h") and not entry.name.startswith(".")
+                        and entry.is_file()):
+                    headers.append(
+                        entry.path[prefix_length:].replace(os.sep, eip.posix_separator))
+    except OSError:
+        # Include path defined in pdsc does not have to exist.
+        pass
+    return sorted(headers)
 
 
 def pdsc_in_folder(folder):
-    """Get pdsc file from single folder."""
-    pdsc = glob.glob(folder + eip.separator() + "*.pdsc")
-    return PurePath(pdsc[0]).as_posix()
+    """Get pdsc file from single folder.
+    Cached until folder content changes, see cached_pdsc_in_folder()."""
+    return cached_pdsc_in_folder(folder, os.stat(folder).st_mtime_ns)
+
+
+@lru_cache(maxsize=64)
+def cached_pdsc_in_folder(folder, modification_time):
+    """Get pdsc file from specific version of single folder."""
+    # First pdsc in directory order, the same as listed by glob.
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if (entry.name.endswith(".pdsc") and not entry.name.startswith(".")
+                    and entry.is_file()):
+                return PurePath(entry.path).as_posix()
+    raise FileNotFoundError("No *.pdsc file in folder: " + folder)
 
 
 def pdsc_coverage(root_path):
     """Create pdsc description coverage report."""
-    visible_headers_via_includes = list()
     start_time = time.time()
     pdsc = pdsc_in_folder(root_path)
     pdsc_name = PurePath(pdsc).name
-    include_paths = pdsc_include_paths(pdsc)
-    headers = all_headers(root_path)
-    includes_list = eip.includes(eip.source_files(root_path))
+    pdsc_content = parse_pdsc(pdsc)
+    include_paths = pdsc_include_paths(pdsc_content)
+    # Pack is walked only once, all source lists are derived from single scan.
+    sources = eip.source_files(root_path)
+    headers = eip.header_files(sources)
+    includes_list = eip.includes(sources)
     visible_headers_via_includes = headers_in_paths_scope(
-        include_paths, includes_list, root_path)
+        include_paths, includes_list, root_path, sources)
     now = datetime.datetime.now()
     time_now = now.strftime("%Y-%m-%d_%H-%M-%S")
 
@@ -187,8 +265,8 @@ def pdsc_coverage(root_path):
         print("Header files visibility: {0:3.1f} %".format(
             visibility_quotient), file=report)
 
-        disk_sources = all_sources(root_path)
-        sources_in_pdsc = pdsc_sources(pdsc)
+        disk_sources = set(sources).difference(headers)
+        sources_in_pdsc = pdsc_sources(pdsc_content)
 
         sources_count = len(disk_sources)
         pdsc_sources_count = len(sources_in_pdsc)
@@ -213,17 +291,17 @@ def pdsc_coverage(root_path):
             "\nCombined headers + sources description coverage: {0:3.1f} %".format(ch_percentage),
             file=report)
 
-        components = pdsc_components(pdsc)
+        components = pdsc_components(pdsc_content)
         print("\nComponents in *.pdsc: ", file=report)
         print("------------------------", file=report)
         eip.print_list(components, file=report)
 
-        bundles = pdsc_bundles(pdsc)
+        bundles = pdsc_bundles(pdsc_content)
         print("\nBundles in *.pdsc: ", file=report)
         print("------------------------", file=report)
         eip.print_list(bundles, file=report)
 
-        examples = pdsc_examples(pdsc)
+        examples = pdsc_examples(pdsc_content)
         print("\nExamples in *.pdsc: ", file=report)
         print("------------------------", file=report)
         eip.print_list(examples, file=report)
@@ -234,13 +312,12 @@ def pdsc_coverage(root_path):
 
         print("\nHeaders visible via pdsc include paths:", file=report)
         print("------------------------", file=report)
-        eip.print_list(visible_headers_via_includes, file=report)
+        eip.print_list(sorted(visible_headers_via_includes), file=report)
         print("\nHeaders not visible via pdsc include paths:", file=report)
         print("------------------------", file=report)
+        # Headers are sorted already, filtered complement needs no set or sorting.
         eip.print_list(
-            sorted(
-                set(headers) -
-                set(visible_headers_via_includes)),
+            [header for header in headers if header not in visible_headers_via_includes],
             file=report)
 
         expanded_pdsc_sources = full_path(root_path, sources_in_pdsc)
@@ -250,11 +327,9 @@ def pdsc_coverage(root_path):
         print("\nSources not described in pdsc:", file=report)
         print("------------------------", file=report)
         eip.print_list(
-            sorted(
-                set(disk_sources) -
-                set(expanded_pdsc_sources)),
-            file=report)
+            sorted(disk_sources.difference(expanded_pdsc_sources)), file=report)
 
+    eip.clear_caches()
     end_time = time.time()
     print(
         "\nExecution time: ", str(